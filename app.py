@@ -1,11 +1,22 @@
 import streamlit as st
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import aiohttp
+import asyncio
+import numpy as np
 import pandas as pd
-import random
 import hashlib
-from datetime import datetime
+import html
+import math
+import os
+import shelve
+import uuid
+from datetime import date
 from io import BytesIO
+from urllib.parse import urlsplit, urlunsplit, parse_qs, urlencode
 from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
 from openpyxl.styles import PatternFill
 
 # --- Streamlit page config ---
@@ -16,6 +27,33 @@ st.caption("Browse and analyze books from a Fable reading list (powered by Fable
 # --- Constants ---
 BASE_URL = "https://api.fable.co/api/v2/users/0c031026-9f1f-4a02-889c-79d2bdb11781/book_lists/33f803be-3e8d-4ed6-bd19-79a330d2bb32/books"
 HEADERS = {"User-Agent": "Mozilla/5.0"}
+MAX_CONCURRENCY = 16
+MAX_RETRIES = 5
+RETRY_BACKOFF = 0.3
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+GALLERY_PAGE_SIZE = 20
+ARROW_STRING_COLUMNS = ["title", "subtitle", "author", "imprint", "isbn"]
+ETAG_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".streamlit", "cache", "fable_etags")
+BOOK_FIELDS = [
+    "id", "title", "subtitle", "authors", "genres", "page_count", "isbn", "published_date",
+    "imprint", "cover_image", "started_reading_at", "finished_reading_at",
+]
+
+
+# --- Shared HTTP session (keep-alive + retries for the synchronous requests) ---
+@st.cache_resource
+def get_http_session() -> requests.Session:
+    """Return a pooled requests.Session that lives across reruns and fetches."""
+    session = requests.Session()
+    session.headers.update(HEADERS)
+    session.mount(
+        "https://",
+        HTTPAdapter(
+            pool_connections=1,
+            max_retries=Retry(total=MAX_RETRIES, backoff_factor=RETRY_BACKOFF, status_forcelist=sorted(RETRY_STATUSES)),
+        ),
+    )
+    return session
 
 
 # --- Utility: Deterministic genre color ---
@@ -24,82 +62,199 @@ def color_from_genre(genre: str) -> str:
     if not genre:
         return "#888888"
     h = int(hashlib.sha1(genre.encode("utf-8")).hexdigest(), 16)
-    random.seed(h)
-    return f"#{random.randint(0, 0xFFFFFF):06x}"
-
-
-@st.cache_data(show_spinner=False)
+    return f"#{(h & 0xFFFFFF):06x}"
+
+
+# --- Pagination helpers ---
+def page_urls(first_page: dict):
+    """Build the URLs of every page after the first, or None if the `next` cursor isn't offset-based."""
+    next_url = first_page.get("next")
+    count = first_page.get("count")
+    if not next_url:
+        return []
+    parts = urlsplit(next_url)
+    query = parse_qs(parts.query)
+    if count is None or "offset" not in query or "limit" not in query:
+        return None
+
+    limit = int(query["limit"][0])
+    urls = []
+    for offset in range(int(query["offset"][0]), count, limit):
+        query["offset"] = [str(offset)]
+        urls.append(urlunsplit(parts._replace(query=urlencode(query, doseq=True))))
+    return urls
+
+
+# --- Conditional GET helpers (ETag cache of page bodies) ---
+def conditional_headers(etag_cache: shelve.Shelf, url: str) -> dict:
+    """Return an If-None-Match header for a page whose ETag was seen before."""
+    cached = etag_cache.get(url)
+    return {"If-None-Match": cached[0]} if cached else {}
+
+
+def remember_page(etag_cache: shelve.Shelf, url: str, etag: str, page: dict) -> dict:
+    """Store a freshly downloaded page under its ETag and return it."""
+    if etag:
+        etag_cache[url] = (etag, page)
+    return page
+
+
+async def fetch_page(
+    session: aiohttp.ClientSession, semaphore: asyncio.BoundedSemaphore, etag_cache: shelve.Shelf, url: str
+) -> dict:
+    """Fetch one page, retrying with exponential backoff on rate limits and server errors."""
+    for attempt in range(MAX_RETRIES + 1):
+        async with semaphore:
+            async with session.get(url, headers=conditional_headers(etag_cache, url)) as resp:
+                if resp.status == 304:
+                    return etag_cache[url][1]
+                if resp.status not in RETRY_STATUSES or attempt == MAX_RETRIES:
+                    resp.raise_for_status()
+                    return remember_page(etag_cache, url, resp.headers.get("ETag"), await resp.json())
+        await asyncio.sleep(RETRY_BACKOFF * 2 ** attempt)
+
+
+async def fetch_remaining_pages(first_page: dict, etag_cache: shelve.Shelf) -> list:
+    """Fetch every page after the first, concurrently when the page offsets are known."""
+    connector = aiohttp.TCPConnector(limit_per_host=MAX_CONCURRENCY)
+    semaphore = asyncio.BoundedSemaphore(MAX_CONCURRENCY)
+    timeout = aiohttp.ClientTimeout(total=30)
+    async with aiohttp.ClientSession(headers=HEADERS, connector=connector, timeout=timeout) as session:
+        urls = page_urls(first_page)
+        if urls is not None:
+            return await asyncio.gather(*[fetch_page(session, semaphore, etag_cache, u) for u in urls])
+
+        # Unknown pagination scheme: follow the `next` cursor one page at a time
+        pages = []
+        url = first_page.get("next")
+        while url:
+            data = await fetch_page(session, semaphore, etag_cache, url)
+            if not data.get("results"):
+                break
+            pages.append(data)
+            url = data.get("next")
+        return pages
+
+
+@st.cache_data(show_spinner=False, persist="disk", max_entries=1)
 def fetch_all_books():
     """Fetch all paginated books from the Fable API and return a DataFrame."""
-    all_books = []
-    url = BASE_URL
-
-    while url:
-        resp = requests.get(url, headers=HEADERS)
-        resp.raise_for_status()
-        data = resp.json()
-        results = data.get("results", [])
-        if not results:
-            break
-
-        for item in results:
-            book = item.get("book", {})
-            all_books.append(book)
-
-        url = data.get("next")
+    os.makedirs(os.path.dirname(ETAG_CACHE_PATH), exist_ok=True)
+    with shelve.open(ETAG_CACHE_PATH) as etag_cache:
+        resp = get_http_session().get(BASE_URL, headers=conditional_headers(etag_cache, BASE_URL), timeout=10)
+        if resp.status_code == 304:
+            first_page = etag_cache[BASE_URL][1]
+        else:
+            resp.raise_for_status()
+            first_page = remember_page(etag_cache, BASE_URL, resp.headers.get("ETag"), resp.json())
+
+        pages = [first_page]
+        if first_page.get("results"):
+            pages += asyncio.run(fetch_remaining_pages(first_page, etag_cache))
+
+    all_books = [
+        item.get("book", {})
+        for page in pages
+        for item in page.get("results", [])
+    ]
 
     # --- Format into DataFrame ---
-    rows = []
-    for b in all_books:
-        authors = b.get("authors", [])
-        genres = b.get("genres", [])
-        finished_at = b.get("finished_reading_at")
-
-        finished_dt = None
-        if finished_at:
-            try:
-                finished_dt = datetime.fromisoformat(finished_at.replace("Z", "+00:00"))
-            except Exception:
-                pass
-
-        rows.append({
-            "title": b.get("title"),
-            "subtitle": b.get("subtitle"),
-            "author": authors[0]["name"] if authors else None,
-            "genre": genres[0]["name"] if genres else "Unknown",
-            "pages": b.get("page_count"),
-            "isbn": b.get("isbn"),
-            "published_date": b.get("published_date"),
-            "imprint": b.get("imprint"),
-            "cover_image": b.get("cover_image"),
-            "book_url": f"https://fable.co/book/{b.get('id')}" if b.get("id") else None,
-            "started_reading": b.get("started_reading_at"),
-            "finished_reading": finished_at,
-            "finished_datetime": finished_dt,
-        })
-    return pd.DataFrame(rows)
+    books = pd.json_normalize(all_books, max_level=0).reindex(columns=BOOK_FIELDS)
+    book_ids = books["id"].astype(str)
+
+    df = pd.DataFrame({
+        "title": books["title"],
+        "subtitle": books["subtitle"],
+        "author": books["authors"].astype(object).str[0].str.get("name"),
+        "genre": books["genres"].astype(object).str[0].str.get("name").fillna("Unknown").astype("category"),
+        "pages": books["page_count"],
+        "isbn": books["isbn"],
+        "published_date": books["published_date"],
+        "imprint": books["imprint"],
+        "cover_image": books["cover_image"],
+        "book_url": ("https://fable.co/book/" + book_ids).where(books["id"].notna()),
+        "started_reading": books["started_reading_at"],
+        "finished_reading": books["finished_reading_at"],
+        # Stored as tz-naive UTC so the cached frame pickles cleanly and exports to Excel
+        "finished_datetime": pd.to_datetime(
+            books["finished_reading_at"], utc=True, errors="coerce", format="ISO8601"
+        ).dt.tz_localize(None),
+    })
+
+    # Arrow-backed text columns (genre stays categorical)
+    for col in ARROW_STRING_COLUMNS:
+        df[col] = df[col].astype("string[pyarrow]")
+
+    # Lowercased title + author, searched in a single pass by the sidebar filter
+    # (inherits string[pyarrow] from the columns above)
+    df["_search_blob"] = (df["title"].fillna("") + "\x1f" + df["author"].fillna("")).str.lower()
+
+    # Unique per fetch; keys the filter cache in place of hashing the whole frame
+    df.attrs["data_version"] = uuid.uuid4().hex
+
+    # Fetch day, used to expire the persisted cache (which ignores ttl) once per calendar day
+    df.attrs["fetched_on"] = date.today().isoformat()
+
+    # Genre palette, cached along with the books instead of rebuilt on every rerun
+    df.attrs["genre_colors"] = {g: color_from_genre(g) for g in df["genre"].cat.categories}
+    return df
+
+
+# --- Filtering + sorting (memoized across reruns) ---
+# `_df` is left out of the cache key (no re-hashing the whole frame per rerun); `data_version`,
+# a fresh id stamped by every fetch_all_books run, stands in for it
+@st.cache_data(show_spinner=False, max_entries=64)
+def filter_and_sort(
+    _df: pd.DataFrame, data_version: str, search: str, genres: tuple, sort_by: str, ascending: bool
+) -> pd.DataFrame:
+    """Apply the sidebar search (already lowercased), genre filter and sort order to the book list."""
+    # No copy needed: every step below returns a new frame and nothing is mutated in place
+    # (st.cache_data also hands callers their own copy of the result)
+    filtered_df = _df
+    if search:
+        filtered_df = filtered_df[
+            filtered_df["_search_blob"].str.contains(search, regex=False, na=False)
+        ]
+    if genres:
+        # Match on the categorical's integer codes rather than the genre strings
+        genre_codes = filtered_df["genre"].cat.categories.get_indexer(genres)
+        genre_codes = genre_codes[genre_codes >= 0]
+        filtered_df = filtered_df[np.isin(filtered_df["genre"].cat.codes.to_numpy(), genre_codes)]
+
+    if sort_by == "finished_reading":
+        filtered_df = filtered_df.sort_values(
+            by="finished_datetime", ascending=ascending, na_position="last"
+        )
+    elif sort_by in filtered_df.columns:
+        filtered_df = filtered_df.sort_values(by=sort_by, ascending=ascending)
+    return filtered_df
 
 
 # --- Excel writer helper ---
 def df_to_excel_with_colors(df: pd.DataFrame, genre_colors: dict) -> BytesIO:
     """Write a DataFrame to an Excel file with genre-based color highlights."""
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Books"
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Books")
+
+    # One shared fill per genre instead of one per row
+    fills = {
+        genre: PatternFill(start_color=color.lstrip("#"), end_color=color.lstrip("#"), fill_type="solid")
+        for genre, color in genre_colors.items()
+    }
+    default_fill = PatternFill(start_color="FFFFFF", end_color="FFFFFF", fill_type="solid")
 
     # Header row
-    for col_idx, col_name in enumerate(df.columns, start=1):
-        ws.cell(row=1, column=col_idx, value=col_name)
+    ws.append(list(df.columns))
 
     # Data rows
-    for row_idx, (_, row) in enumerate(df.iterrows(), start=2):
-        genre = row.get("genre", "Unknown")
-        color = genre_colors.get(genre, "#FFFFFF").replace("#", "")
-        fill = PatternFill(start_color=color, end_color=color, fill_type="solid")
-
-        for col_idx, value in enumerate(row, start=1):
-            cell = ws.cell(row=row_idx, column=col_idx, value=value)
+    for row in df.itertuples(index=False):
+        fill = fills.get(getattr(row, "genre", "Unknown"), default_fill)
+        cells = []
+        for value in row:
+            cell = WriteOnlyCell(ws, value=None if pd.isna(value) else value)
             cell.fill = fill
+            cells.append(cell)
+        ws.append(cells)
 
     output = BytesIO()
     wb.save(output)
@@ -121,6 +276,60 @@ def display_genre_legend(genre_colors: dict):
             )
 
 
+# --- Gallery helpers ---
+def book_card_html(row, genre_colors: dict) -> str:
+    """Render one gallery entry (cover, title, author, genre chip, date) as a single HTML block."""
+    cover = ""
+    if pd.notna(row.cover_image):
+        # Let the browser fetch covers lazily instead of Streamlit downloading each one
+        cover = f'<img src="{html.escape(row.cover_image)}" loading="lazy" width="110">'
+
+    title = html.escape(row.title if pd.notna(row.title) else "Untitled")
+    url = html.escape(row.book_url if pd.notna(row.book_url) else "")
+    details = [f'<a href="{url}" target="_blank"><strong>{title}</strong></a>']
+
+    if pd.notna(row.author):
+        details.append(f"<div>by {html.escape(row.author)}</div>")
+
+    genre_color = genre_colors.get(row.genre, "#888888")
+    details.append(
+        f'<div><span style="background-color:{genre_color}; color:white; '
+        f'padding:3px 8px; border-radius:6px; font-size:0.85em;">'
+        f"{html.escape(str(row.genre))}</span></div>"
+    )
+
+    caption = None
+    if pd.notna(row.finished_datetime):
+        caption = f"Finished: {row.finished_datetime.strftime('%B %d, %Y')}"
+    elif pd.notna(row.published_date):
+        caption = f"Published: {row.published_date}"
+    if caption:
+        details.append(f'<div style="color:gray; font-size:0.85em;">{html.escape(caption)}</div>')
+
+    return (
+        f'<div style="display:flex; gap:1.5rem; margin-bottom:1rem;">'
+        f'<div style="flex:0 0 110px;">{cover}</div>'
+        f'<div style="display:flex; flex-direction:column; gap:0.4rem;">{"".join(details)}</div>'
+        f"</div>"
+    )
+
+
+@st.fragment
+def display_gallery(books: pd.DataFrame, genre_colors: dict):
+    """Display one page of the book gallery; paging reruns only this fragment."""
+    page_count = max(1, math.ceil(len(books) / GALLERY_PAGE_SIZE))
+    page = st.number_input("Page", min_value=1, max_value=page_count, value=1, step=1)
+    st.caption(f"Page {page} of {page_count}")
+
+    # One markdown element per page instead of several Streamlit elements per book
+    start = (page - 1) * GALLERY_PAGE_SIZE
+    page_books = books.iloc[start:start + GALLERY_PAGE_SIZE]
+    st.markdown(
+        "".join(book_card_html(row, genre_colors) for row in page_books.itertuples(index=False)),
+        unsafe_allow_html=True,
+    )
+
+
 # --- Main Execution ---
 if "books_df" not in st.session_state:
     st.session_state.books_df = None
@@ -130,7 +339,12 @@ if st.session_state.books_df is None:
     if fetch_now:
         with st.spinner("Fetching books..."):
             df = fetch_all_books()
+            if df.attrs.get("fetched_on") != date.today().isoformat():
+                # Drop yesterday's entry (memory and disk); the refetch is cheap thanks to ETag revalidation
+                fetch_all_books.clear()
+                df = fetch_all_books()
             st.session_state.books_df = df
+            st.session_state.genres = df["genre"].cat.categories.tolist()
             st.rerun()
     else:
         st.info("Click the button above to fetch books from Fable.")
@@ -141,34 +355,21 @@ else:
     st.sidebar.header("Filters and Sorting")
 
     search = st.sidebar.text_input("Search title or author")
-    selected_genres = st.sidebar.multiselect("Filter by genre", sorted(df["genre"].unique()))
+    selected_genres = st.sidebar.multiselect("Filter by genre", st.session_state.genres)
     sort_by = st.sidebar.selectbox(
         "Sort by", ["title", "author", "published_date", "finished_reading"]
     )
     ascending = st.sidebar.checkbox("Ascending", value=True)
 
-    # --- Filtering logic ---
-    filtered_df = df.copy()
-    if search:
-        filtered_df = filtered_df[
-            filtered_df["title"].str.contains(search, case=False, na=False) |
-            filtered_df["author"].str.contains(search, case=False, na=False)
-        ]
-    if selected_genres:
-        filtered_df = filtered_df[filtered_df["genre"].isin(selected_genres)]
-
-    # --- Sorting logic ---
-    if sort_by == "finished_reading":
-        filtered_df = filtered_df.sort_values(
-            by="finished_datetime", ascending=ascending, na_position="last"
-        )
-    else:
-        if sort_by in filtered_df.columns:
-            filtered_df = filtered_df.sort_values(by=sort_by, ascending=ascending)
+    # --- Filtering and sorting ---
+    # Case-fold the query once so "Dune" and "dune" share a cache entry
+    filtered_df = filter_and_sort(
+        df, df.attrs["data_version"], search.lower(), tuple(selected_genres), sort_by, ascending
+    )
 
     # --- Genre colors (consistent) ---
-    unique_genres = sorted(filtered_df["genre"].unique())
-    genre_colors = {g: color_from_genre(g) for g in unique_genres}
+    present_genres = set(filtered_df["genre"].unique())
+    genre_colors = {g: c for g, c in df.attrs["genre_colors"].items() if g in present_genres}
 
     # --- Genre legend ---
     display_genre_legend(genre_colors)
@@ -177,21 +378,24 @@ else:
     view_mode = st.radio("Select View Mode", ["Table View", "Gallery View"], horizontal=True)
 
     if view_mode == "Table View":
-        def highlight_genre(row):
-            color = genre_colors.get(row["genre"], "#444444")
-            return [f"background-color: {color}20" for _ in row]
+        def highlight_genre(frame):
+            # Build the whole CSS frame at once from the genre column instead of row by row
+            colors = frame["genre"].map(genre_colors).astype(object).fillna("#444444")
+            css = "background-color: " + colors + "20"
+            return pd.DataFrame({col: css for col in frame.columns}, index=frame.index)
 
         st.subheader("Book Data")
         styled_df = (
             filtered_df[
                 ["title", "author", "genre", "pages", "published_date", "started_reading", "finished_reading"]
             ]
-            .style.apply(highlight_genre, axis=1)
+            .style.apply(highlight_genre, axis=None)
         )
         st.dataframe(styled_df, use_container_width=True)
 
         # --- Download Excel ---
-        excel_data = df_to_excel_with_colors(filtered_df, genre_colors)
+        export_df = filtered_df.loc[:, ~filtered_df.columns.str.startswith("_")]
+        excel_data = df_to_excel_with_colors(export_df, genre_colors)
         st.download_button(
             "Download Excel",
             data=excel_data,
@@ -201,30 +405,4 @@ else:
 
     elif view_mode == "Gallery View":
         st.subheader("Book Gallery")
-        for _, row in filtered_df.iterrows():
-            with st.container():
-                cols = st.columns([1, 3])
-                with cols[0]:
-                    if row["cover_image"]:
-                        st.image(row["cover_image"], width=110)
-                with cols[1]:
-                    title = row.get("title", "Untitled")
-                    url = row.get("book_url", "")
-                    st.markdown(f"**[{title}]({url})**")
-
-                    if row.get("author"):
-                        st.write(f"by {row['author']}")
-
-                    genre_color = genre_colors.get(row["genre"], "#888888")
-                    st.markdown(
-                        f'<span style="background-color:{genre_color}; color:white; '
-                        f'padding:3px 8px; border-radius:6px; font-size:0.85em;">'
-                        f'{row["genre"]}</span>',
-                        unsafe_allow_html=True,
-                    )
-
-                    if row.get("finished_datetime"):
-                        finished_date = row["finished_datetime"].strftime("%B %d, %Y")
-                        st.caption(f"Finished: {finished_date}")
-                    elif row.get("published_date"):
-                        st.caption(f"Published: {row['published_date']}")
+        display_gallery(filtered_df, genre_colors)